@@ -1,19 +1,95 @@
 from typing import Dict, Any, List, Optional
-from pydantic import BaseModel
-import requests
+from dataclasses import dataclass
+import aiohttp
+import asyncio
+import orjson
+import random
+import xxhash
 import time
 from dotenv import load_dotenv
 import os
 from cache_service import cache_service
+from config import NOMINATIM_RATE_LIMIT
 
 load_dotenv()
 
-class Coordinates(BaseModel):
+USER_AGENT = os.getenv("USER_AGENT", "MultiAgent-AI-Assistant/1.0")
+
+# Shared HTTP session (keep-alive connection pool for Nominatim/Overpass)
+_http_session: Optional[aiohttp.ClientSession] = None
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session, creating it on first use"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=256,
+                limit_per_host=64,
+                keepalive_timeout=75,
+                ttl_dns_cache=300  # Skip DNS lookups on warm connections
+            ),
+            headers={"User-Agent": USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+    return _http_session
+
+async def close_http_session():
+    """Close the shared aiohttp session"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+# Overpass QL query templates, filled in per request with radius and coordinates
+_OVERPASS_QUERY = """
+[out:json];
+(
+  node["amenity"="school"](around:{radius},{lat},{lon});
+  node["amenity"="hospital"](around:{radius},{lat},{lon});
+  node["amenity"="restaurant"](around:{radius},{lat},{lon});
+  node["amenity"="fuel"](around:{radius},{lat},{lon});
+  node["amenity"="bank"](around:{radius},{lat},{lon});
+  node["amenity"="pharmacy"](around:{radius},{lat},{lon});
+  node["leisure"="park"](around:{radius},{lat},{lon});
+  node["leisure"="pitch"]["sport"="basketball"](around:{radius},{lat},{lon});
+  node["leisure"="pitch"]["sport"="tennis"](around:{radius},{lat},{lon});
+  node["leisure"="pitch"]["sport"="soccer"](around:{radius},{lat},{lon});
+  node["aeroway"="aerodrome"](around:{airport_radius},{lat},{lon});
+  way["highway"="motorway"](around:{highway_radius},{lat},{lon});
+  way["highway"="primary"](around:{radius},{lat},{lon});
+  node["shop"="supermarket"](around:{radius},{lat},{lon});
+  node["shop"="mall"](around:{radius},{lat},{lon});
+);
+out body;
+"""
+
+# Reduced query used for radii above 3km
+_OVERPASS_QUERY_LARGE = """
+[out:json];
+(
+  node["amenity"~"^(school|hospital|restaurant|fuel|bank|pharmacy)$"](around:{radius},{lat},{lon});
+  node["leisure"="park"](around:{radius},{lat},{lon});
+  node["shop"~"^(supermarket|mall)$"](around:{radius},{lat},{lon});
+);
+out body;
+"""
+
+# OSM tag keys that determine amenity type and name, in order of precedence
+_TYPE_KEYS = ("amenity", "leisure", "aeroway", "highway", "shop")
+_NAME_KEYS = ("name", "brand", "operator")
+_TYPE_KEY_RANK = {key: rank for rank, key in enumerate(_TYPE_KEYS)}
+_NAME_KEY_RANK = {key: rank for rank, key in enumerate(_NAME_KEYS)}
+
+# Internal transport types; validation happens at the API boundary
+@dataclass(slots=True, frozen=True)
+class Coordinates:
     latitude: float
     longitude: float
     address: str
 
-class Amenity(BaseModel):
+@dataclass(slots=True, frozen=True)
+class Amenity:
     name: str
     amenity_type: str
     distance: Optional[float] = None
@@ -24,9 +100,44 @@ class GeocodingAgent:
     
     def __init__(self):
         self.base_url = "https://nominatim.openstreetmap.org/search"
-        self.user_agent = os.getenv("USER_AGENT", "MultiAgent-AI-Assistant/1.0")
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": self.user_agent})
+        self.max_retries = 3
+        # Local rate limiting, used only when Redis is unavailable
+        self._rate_lock = asyncio.Lock()
+        self._last_request = 0.0
+    
+    async def _wait_for_rate_limit(self):
+        """Space Nominatim requests without blocking the event loop"""
+        # Shared across workers through Redis when available
+        while True:
+            wait = await cache_service.acquire_rate_slot("nominatim", NOMINATIM_RATE_LIMIT)
+            if wait is None:
+                break
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+        
+        # Per-process fallback when Redis is down
+        async with self._rate_lock:
+            wait = NOMINATIM_RATE_LIMIT - (time.monotonic() - self._last_request)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_request = time.monotonic()
+    
+    async def _search(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Query Nominatim, backing off exponentially on 429/5xx responses"""
+        session = await get_http_session()
+        
+        for attempt in range(self.max_retries):
+            await self._wait_for_rate_limit()
+            async with session.get(self.base_url, params=params) as response:
+                retryable = response.status == 429 or response.status >= 500
+                if not retryable or attempt == self.max_retries - 1:
+                    response.raise_for_status()
+                    return orjson.loads(await response.read())
+            
+            delay = 2 ** attempt + random.random()
+            print(f"Nominatim returned HTTP {response.status}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
     
     async def geocode_address(self, address: str) -> Optional[Coordinates]:
         """
@@ -39,53 +150,49 @@ class GeocodingAgent:
             Coordinates object with lat/lng or None if not found
         """
         try:
-            # Check cache first
-            cached_result = await cache_service.get('geocoding', {'address': address})
-            if cached_result:
-                print(f"Using cached geocoding for: {address}")
-                return Coordinates(**cached_result)
-            
-            print(f"Geocoding address: {address}")
-            
-            # Add US country code to improve accuracy
-            params = {
-                "q": address,
-                "format": "json",
-                "countrycodes": "us",
-                "limit": 1
-            }
-            
-            response = self.session.get(self.base_url, params=params)
-            response.raise_for_status()
-            
-            # Rate limiting - Nominatim requires 1 request per second
-            time.sleep(1)
-            
-            data = response.json()
-            
-            if data and len(data) > 0:
-                result = data[0]
-                coords = Coordinates(
-                    latitude=float(result["lat"]),
-                    longitude=float(result["lon"]),
-                    address=result["display_name"]
-                )
-                
-                # Cache the result
-                await cache_service.set('geocoding', {'address': address}, coords.dict())
-                
-                print(f"Found coordinates: {coords.latitude}, {coords.longitude}")
-                return coords
-            else:
+            # Cached, or shared with an identical request already in flight
+            coords = await cache_service.get_or_compute(
+                'geocoding',
+                {'address': address},
+                lambda: self._geocode(address),
+                decode=lambda cached: Coordinates(**cached)
+            )
+            if coords is None:
                 print(f"No coordinates found for address: {address}")
-                return None
+            return coords
                 
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"Error geocoding address: {e}")
             return None
         except (KeyError, ValueError) as e:
             print(f"Error parsing geocoding response: {e}")
             return None
+    
+    async def _geocode(self, address: str) -> Optional[Coordinates]:
+        """Geocode an address with Nominatim"""
+        print(f"Geocoding address: {address}")
+        
+        # Add US country code to improve accuracy
+        params = {
+            "q": address,
+            "format": "json",
+            "countrycodes": "us",
+            "limit": 1
+        }
+        
+        data = await self._search(params)
+        
+        if not data:
+            return None
+        
+        result = data[0]
+        coords = Coordinates(
+            latitude=float(result["lat"]),
+            longitude=float(result["lon"]),
+            address=result["display_name"]
+        )
+        print(f"Found coordinates: {coords.latitude}, {coords.longitude}")
+        return coords
 
 class AmenitiesAgent:
     """Agent responsible for finding nearby amenities using Overpass API"""
@@ -96,8 +203,9 @@ class AmenitiesAgent:
             "https://lz4.overpass-api.de/api/interpreter",
             "https://z.overpass-api.de/api/interpreter"
         ]
-        self.current_url_index = 0
-        self.session = requests.Session()
+        # Per-server scoreboard: latency EWMA and decaying failure rate
+        self.stats = {url: {"ewma_ms": 500.0, "fail": 0.0} for url in self.base_urls}
+        self.explore_rate = 0.1  # Chance of trying a random server first
         self.default_radius = 1000  # Default radius in meters
     
     async def find_nearby_amenities(self, coordinates: Coordinates, radius: Optional[int] = None) -> List[Amenity]:
@@ -116,108 +224,161 @@ class AmenitiesAgent:
             search_radius = radius if radius is not None else self.default_radius
             lat, lon = coordinates.latitude, coordinates.longitude
             
-            # Check cache first
+            # Cached (served stale while refreshing once expired), or shared
+            # with an identical request already in flight
             cache_key = {
                 'lat': lat,
                 'lon': lon,
                 'radius': search_radius
             }
-            cached_result = await cache_service.get('amenities', cache_key)
-            if cached_result:
-                print(f"Using cached amenities for: {lat}, {lon} (radius: {search_radius}m)")
-                return [Amenity(**amenity) for amenity in cached_result]
-            
-            print(f"Searching for amenities within {search_radius}m of {lat}, {lon}")
+            return await cache_service.get_or_compute(
+                'amenities',
+                cache_key,
+                lambda: self._fetch_amenities(lat, lon, search_radius),
+                decode=lambda cached: [Amenity(**amenity) for amenity in cached]
+            )
             
-            # Overpass QL query for various amenities with dynamic radius
-            airport_radius = search_radius * 5  # Larger radius for airports
-            highway_radius = search_radius * 2  # Larger radius for highways
-            
-            # Use simpler query for large radius to avoid timeouts
-            if search_radius > 3000:
-                query = f"""
-                [out:json];
-                (
-                  node["amenity"~"^(school|hospital|restaurant|fuel|bank|pharmacy)$"](around:{search_radius},{lat},{lon});
-                  node["leisure"="park"](around:{search_radius},{lat},{lon});
-                  node["shop"~"^(supermarket|mall)$"](around:{search_radius},{lat},{lon});
-                );
-                out body;
-                """
-            else:
-                query = f"""
-                [out:json];
-                (
-                  node["amenity"="school"](around:{search_radius},{lat},{lon});
-                  node["amenity"="hospital"](around:{search_radius},{lat},{lon});
-                  node["amenity"="restaurant"](around:{search_radius},{lat},{lon});
-                  node["amenity"="fuel"](around:{search_radius},{lat},{lon});
-                  node["amenity"="bank"](around:{search_radius},{lat},{lon});
-                  node["amenity"="pharmacy"](around:{search_radius},{lat},{lon});
-                  node["leisure"="park"](around:{search_radius},{lat},{lon});
-                  node["leisure"="pitch"]["sport"="basketball"](around:{search_radius},{lat},{lon});
-                  node["leisure"="pitch"]["sport"="tennis"](around:{search_radius},{lat},{lon});
-                  node["leisure"="pitch"]["sport"="soccer"](around:{search_radius},{lat},{lon});
-                  node["aeroway"="aerodrome"](around:{airport_radius},{lat},{lon});
-                  way["highway"="motorway"](around:{highway_radius},{lat},{lon});
-                  way["highway"="primary"](around:{search_radius},{lat},{lon});
-                  node["shop"="supermarket"](around:{search_radius},{lat},{lon});
-                  node["shop"="mall"](around:{search_radius},{lat},{lon});
-                );
-                out body;
-                """
-            
-            # Try different Overpass servers if one fails
-            for attempt in range(len(self.base_urls)):
-                try:
-                    current_url = self.base_urls[self.current_url_index]
-                    print(f"Trying Overpass server: {current_url}")
-                    
-                    response = self.session.post(
-                        current_url,
-                        data=query,
-                        headers={"Content-Type": "text/plain"},
-                        timeout=30
-                    )
-                    response.raise_for_status()
-                    break  # Success, exit the retry loop
-                    
-                except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
-                    print(f"Server {current_url} failed: {e}")
-                    self.current_url_index = (self.current_url_index + 1) % len(self.base_urls)
-                    if attempt == len(self.base_urls) - 1:  # Last attempt
-                        raise e
-            
-            data = response.json()
-            amenities = self._parse_amenities(data["elements"])
-            
-            # Cache the result
-            await cache_service.set('amenities', cache_key, [amenity.dict() for amenity in amenities])
-            
-            print(f"Found {len(amenities)} amenities")
-            return amenities
-            
-        except requests.exceptions.Timeout as e:
+        except asyncio.TimeoutError as e:
             print(f"Timeout error querying amenities: {e}")
             print("Retrying with smaller radius...")
             # Retry with smaller radius
             if search_radius > 1000:
                 return await self.find_nearby_amenities(coordinates, 1000)
             return []
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 504:
+        except aiohttp.ClientResponseError as e:
+            if e.status == 504:
                 print(f"Overpass API timeout (504). Retrying with smaller radius...")
                 if search_radius > 1000:
                     return await self.find_nearby_amenities(coordinates, 1000)
             print(f"HTTP error querying amenities: {e}")
             return []
-        except requests.exceptions.RequestException as e:
+        except aiohttp.ClientError as e:
             print(f"Error querying amenities: {e}")
             return []
         except (KeyError, ValueError) as e:
             print(f"Error parsing amenities response: {e}")
             return []
     
+    async def _fetch_amenities(self, lat: float, lon: float, search_radius: int) -> List[Amenity]:
+        """Query Overpass for amenities around a point"""
+        print(f"Searching for amenities within {search_radius}m of {lat}, {lon}")
+        
+        # Overpass QL query for various amenities with dynamic radius
+        # Use simpler query for large radius to avoid timeouts
+        query_template = _OVERPASS_QUERY_LARGE if search_radius > 3000 else _OVERPASS_QUERY
+        query = query_template.format(
+            radius=search_radius,
+            airport_radius=search_radius * 5,  # Larger radius for airports
+            highway_radius=search_radius * 2,  # Larger radius for highways
+            lat=lat,
+            lon=lon
+        ).encode()
+        
+        # Query the best Overpass server, hedging to others if needed
+        data = await self._query_overpass(query)
+        amenities = self._parse_amenities(data["elements"])
+        
+        print(f"Found {len(amenities)} amenities")
+        return amenities
+    
+    async def _query_mirror(self, url: str, query: bytes) -> Dict[str, Any]:
+        """POST a query to a single Overpass server, recording its latency and outcome"""
+        session = await get_http_session()
+        start = time.monotonic()
+        try:
+            async with session.post(
+                url,
+                data=query,
+                headers={"Content-Type": "text/plain"}
+            ) as response:
+                response.raise_for_status()
+                data = orjson.loads(await response.read())
+        except asyncio.CancelledError:
+            # Lost a hedged race: the server took at least this long, but that is a
+            # lower bound rather than a measurement, so only ever raise the estimate
+            # and leave its failure rate alone
+            stats = self.stats[url]
+            stats["ewma_ms"] = max(stats["ewma_ms"], (time.monotonic() - start) * 1000)
+            raise
+        except asyncio.TimeoutError:
+            self._record_mirror(url, (time.monotonic() - start) * 1000, failed=True)
+            raise
+        except (aiohttp.ClientError, ValueError):
+            self._record_mirror(url, None, failed=True)
+            raise
+        
+        self._record_mirror(url, (time.monotonic() - start) * 1000, failed=False)
+        return data
+    
+    def _record_mirror(self, url: str, elapsed_ms: Optional[float], failed: bool):
+        """Fold one request outcome into the server's scoreboard entry"""
+        stats = self.stats[url]
+        if elapsed_ms is not None:
+            stats["ewma_ms"] = 0.8 * stats["ewma_ms"] + 0.2 * elapsed_ms
+        stats["fail"] = 0.8 * stats["fail"] + (0.2 if failed else 0.0)
+    
+    def _rank_mirrors(self) -> List[str]:
+        """Order servers best-first, occasionally promoting a random one to re-evaluate it"""
+        ranked = sorted(
+            self.base_urls,
+            key=lambda url: self.stats[url]["ewma_ms"] * (1 + self.stats[url]["fail"])
+        )
+        if random.random() < self.explore_rate:
+            ranked.insert(0, ranked.pop(random.randrange(len(ranked))))
+        return ranked
+    
+    async def _query_overpass(self, query: bytes) -> Dict[str, Any]:
+        """
+        Query the best Overpass server, hedging to the next ones if it is slow or fails
+        
+        Args:
+            query: Overpass QL query
+            
+        Returns:
+            Parsed JSON response from the first server that succeeds
+        """
+        remaining = self._rank_mirrors()
+        # Hedge once the primary takes twice its usual latency (at least 1s)
+        hedge_delay = max(2 * self.stats[remaining[0]]["ewma_ms"], 1000) / 1000
+        
+        tasks = {}
+        pending = set()
+        last_error = None
+        
+        def launch_next():
+            url = remaining.pop(0)
+            print(f"Trying Overpass server: {url}")
+            task = asyncio.create_task(self._query_mirror(url, query))
+            tasks[task] = url
+            pending.add(task)
+        
+        launch_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=hedge_delay if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch_next()  # Slow server, race the next one alongside it
+                    continue
+                
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        return task.result()
+                    except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+                        print(f"Server {tasks[task]} failed: {e}")
+                        last_error = e
+                
+                if remaining:
+                    launch_next()  # Replace the failed server immediately
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+    
     def _parse_amenities(self, elements: List[Dict]) -> List[Amenity]:
         """Parse Overpass API response into Amenity objects"""
         amenities = []
@@ -226,16 +387,39 @@ class AmenitiesAgent:
         for element in elements:
             tags = element.get("tags", {})
             
-            # Determine amenity type and name
-            amenity_type = self._get_amenity_type(tags)
-            name = self._get_amenity_name(tags, amenity_type)
+            # Determine amenity type and name in a single pass over the tags
+            type_rank, name_rank = len(_TYPE_KEYS), len(_NAME_KEYS)
+            type_key = type_value = name = sport = None
+            for key, value in tags.items():
+                rank = _TYPE_KEY_RANK.get(key)
+                if rank is not None:
+                    if rank < type_rank:
+                        type_rank, type_key, type_value = rank, key, value
+                    continue
+                rank = _NAME_KEY_RANK.get(key)
+                if rank is not None:
+                    if rank < name_rank:
+                        name_rank, name = rank, value
+                elif key == "sport":
+                    sport = value
+            
+            if type_key is None:
+                amenity_type = "unknown"
+            elif type_key == "leisure" and sport is not None:
+                amenity_type = f"leisure:{type_value}:{sport}"
+            else:
+                amenity_type = f"{type_key}:{type_value}"
+            
+            if name is None:
+                # Fallback to amenity type
+                name = amenity_type.replace(":", " ").title()
             
             if name and amenity_type:
-                # Normalize name for deduplication
-                normalized_name = name.lower().strip()
-                if normalized_name in seen_names:
+                # Normalize name for deduplication, keeping only an int hash
+                name_hash = xxhash.xxh3_64_intdigest(name.strip().casefold().encode())
+                if name_hash in seen_names:
                     continue  # Skip duplicates
-                seen_names.add(normalized_name)
+                seen_names.add(name_hash)
                 
                 amenity = Amenity(
                     name=name,
@@ -248,29 +432,3 @@ class AmenitiesAgent:
                 amenities.append(amenity)
         
         return amenities
-    
-    def _get_amenity_type(self, tags: Dict[str, str]) -> str:
-        """Extract amenity type from OSM tags"""
-        if "amenity" in tags:
-            return f"amenity:{tags['amenity']}"
-        elif "leisure" in tags:
-            if "sport" in tags:
-                return f"leisure:{tags['leisure']}:{tags['sport']}"
-            return f"leisure:{tags['leisure']}"
-        elif "aeroway" in tags:
-            return f"aeroway:{tags['aeroway']}"
-        elif "highway" in tags:
-            return f"highway:{tags['highway']}"
-        elif "shop" in tags:
-            return f"shop:{tags['shop']}"
-        return "unknown"
-    
-    def _get_amenity_name(self, tags: Dict[str, str], amenity_type: str) -> str:
-        """Extract amenity name from OSM tags"""
-        # Try different name fields
-        for name_field in ["name", "brand", "operator"]:
-            if name_field in tags:
-                return tags[name_field]
-        
-        # Fallback to amenity type
-        return amenity_type.replace(":", " ").title()
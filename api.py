@@ -1,11 +1,15 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import os
+import orjson
 from dotenv import load_dotenv
 from workflow import MultiAgentWorkflow
-from agents import Coordinates, Amenity
+from agents import Coordinates, Amenity, get_http_session, close_http_session
+from cache_service import cache_service
+from config import AMENITY_TYPES, DEFAULT_SEARCH_RADIUS
 
 # Load environment variables
 load_dotenv()
@@ -14,7 +18,8 @@ load_dotenv()
 app = FastAPI(
     title="Multi-Agent AI Assistant API",
     description="API for processing US addresses and finding nearby amenities",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware for NextJS frontend
@@ -34,6 +39,18 @@ app.add_middleware(
 # Initialize the workflow
 workflow = MultiAgentWorkflow()
 
+@app.on_event("startup")
+async def startup():
+    """Open the shared HTTP connection pool and cache"""
+    await get_http_session()
+    await workflow.initialize()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release the shared HTTP connection pool and cache"""
+    await close_http_session()
+    await cache_service.close()
+
 # Request/Response Models
 class AddressRequest(BaseModel):
     address: str = Field(..., description="US address to process")
@@ -88,37 +105,18 @@ async def process_address(request: AddressRequest):
         # Process the address through the workflow
         result = await workflow.process_address(request.address, request.radius)
         
-        # Convert coordinates to response model
-        coordinates_response = None
-        if result["coordinates"]:
-            coords = result["coordinates"]
-            coordinates_response = CoordinatesResponse(
-                latitude=coords.latitude,
-                longitude=coords.longitude,
-                address=coords.address
-            )
-        
-        # Convert amenities to response model
-        amenities_response = []
-        for amenity in result["amenities"]:
-            amenity_response = AmenityResponse(
-                name=amenity.name,
-                amenity_type=amenity.amenity_type,
-                distance=amenity.distance,
-                coordinates=amenity.coordinates
-            )
-            amenities_response.append(amenity_response)
-        
-        return AddressResponse(
-            success=result["success"],
-            address=result["address"],
-            coordinates=coordinates_response,
-            amenities=amenities_response,
-            categorized_amenities=result.get("categorized_amenities"),
-            result=result["result"],
-            error=result["error"],
-            radius_used=request.radius
-        )
+        # Serialize the workflow's dataclasses directly; their fields match
+        # CoordinatesResponse/AmenityResponse, so no intermediate models are built
+        return ORJSONResponse(content={
+            "success": result["success"],
+            "address": result["address"],
+            "coordinates": result["coordinates"],
+            "amenities": result["amenities"],
+            "categorized_amenities": result.get("categorized_amenities"),
+            "result": result["result"],
+            "error": result["error"],
+            "radius_used": request.radius
+        })
         
     except Exception as e:
         raise HTTPException(
@@ -126,6 +124,54 @@ async def process_address(request: AddressRequest):
             detail=f"Error processing address: {str(e)}"
         )
 
+@app.post("/process-address/stream")
+async def process_address_stream(request: AddressRequest):
+    """
+    Process a US address, streaming the AI analysis as it is generated
+    
+    Args:
+        request: AddressRequest containing address and optional radius
+        
+    Returns:
+        Newline-delimited JSON events: "context" (coordinates and amenities),
+        "analysis" (text chunks), then "done", or a single "error"
+    """
+    # Validate API key
+    if not os.getenv("GOOGLE_API_KEY"):
+        raise HTTPException(
+            status_code=500, 
+            detail="Google API key not configured"
+        )
+    
+    async def events():
+        async for event in workflow.process_address_stream(request.address, request.radius):
+            if event["type"] == "context":
+                event["radius_used"] = request.radius
+            yield orjson.dumps(event) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+# Constant response bodies, serialized once at import
+_AMENITY_TYPES_BYTES = orjson.dumps({
+    "amenity_types": AMENITY_TYPES,
+    "default_radius": DEFAULT_SEARCH_RADIUS,
+    "min_radius": 100,
+    "max_radius": 10000
+})
+
+_HEALTH_BYTES = {
+    api_key_configured: orjson.dumps({
+        "status": "healthy",
+        "api_key_configured": api_key_configured,
+        "services": {
+            "nominatim": "available",
+            "overpass": "available",
+            "gemini": "configured" if api_key_configured else "not_configured"
+        }
+    })
+    for api_key_configured in (True, False)
+}
+
 @app.get("/amenity-types")
 async def get_amenity_types():
     """
@@ -134,42 +180,14 @@ async def get_amenity_types():
     Returns:
         Dictionary of amenity categories and their types
     """
-    return {
-        "amenity_types": {
-            "education": ["school", "university", "college"],
-            "healthcare": ["hospital", "clinic", "pharmacy"],
-            "food": ["restaurant", "cafe", "fast_food"],
-            "shopping": ["supermarket", "mall", "shop"],
-            "recreation": ["park", "pitch", "sports_centre"],
-            "transportation": ["fuel", "aerodrome", "motorway"],
-            "services": ["bank", "atm", "post_office"]
-        },
-        "default_radius": 1000,
-        "min_radius": 100,
-        "max_radius": 10000
-    }
+    return Response(content=_AMENITY_TYPES_BYTES, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
     """Detailed health check endpoint"""
-    try:
-        # Check if API key is configured
-        api_key_configured = bool(os.getenv("GOOGLE_API_KEY"))
-        
-        return {
-            "status": "healthy",
-            "api_key_configured": api_key_configured,
-            "services": {
-                "nominatim": "available",
-                "overpass": "available",
-                "gemini": "configured" if api_key_configured else "not_configured"
-            }
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "error": str(e)
-        }
+    # Check if API key is configured
+    api_key_configured = bool(os.getenv("GOOGLE_API_KEY"))
+    return Response(content=_HEALTH_BYTES[api_key_configured], media_type="application/json")
 
 @app.get("/ping")
 async def ping():
@@ -1,31 +1,46 @@
-import json
-import hashlib
+import orjson
+import xxhash
+import zstandard as zstd
 import os
 import asyncio
-from typing import Optional, Any, Dict
+import time
+from typing import Optional, Any, Awaitable, Callable, Dict
 import redis.asyncio as redis
-from datetime import datetime, timedelta
+from collections import OrderedDict
+
+# Payloads at least this large are zstd-compressed before going to Redis
+COMPRESS_MIN_BYTES = 1024
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
 
 class CacheService:
     """Redis-based caching service with fallback to in-memory cache"""
     
     def __init__(self):
         self.redis_client = None
-        self.memory_cache = {}
+        self.memory_cache = OrderedDict()  # LRU of key -> (payload, stored_at)
+        self.memory_cache_size = 1024
+        self.inflight: Dict[str, asyncio.Future] = {}  # Single-flight map of key -> pending result
+        self.refreshing = set()  # Keys with a stale-while-revalidate refresh scheduled
+        self._background_tasks = set()
         self.cache_ttl = {
             'geocoding': 24 * 60 * 60,  # 24 hours
             'amenities': 6 * 60 * 60,    # 6 hours
             'categorization': 12 * 60 * 60,  # 12 hours
             'analysis': 12 * 60 * 60     # 12 hours
         }
+        # Extra time an expired entry may still be served while it is refreshed
+        self.stale_grace = {
+            'amenities': 60 * 60  # 1 hour
+        }
+        self._compressor = zstd.ZstdCompressor(level=3)
+        self._decompressor = zstd.ZstdDecompressor()
     
     async def initialize(self):
         """Initialize Redis connection with fallback to memory cache"""
         try:
             self.redis_client = redis.from_url(
-                "redis://localhost:6379", 
-                encoding="utf-8", 
-                decode_responses=True
+                "redis://localhost:6379",
+                decode_responses=False  # Values are raw orjson bytes
             )
             # Test connection
             await self.redis_client.ping()
@@ -36,60 +51,191 @@ class CacheService:
     
     def _generate_key(self, cache_type: str, data: Any) -> str:
         """Generate cache key from data"""
-        data_str = json.dumps(data, sort_keys=True)
-        hash_key = hashlib.md5(data_str.encode()).hexdigest()
+        data_bytes = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        # Keys are only used for lookup, so a fast non-cryptographic hash suffices
+        hash_key = xxhash.xxh3_128(data_bytes).hexdigest()
         return f"saco:{cache_type}:{hash_key}"
     
-    async def get(self, cache_type: str, data: Any) -> Optional[Any]:
-        """Get cached data"""
+    def _storage_ttl(self, cache_type: str) -> int:
+        """How long an entry is kept: its TTL plus any stale grace period"""
+        return self.cache_ttl.get(cache_type, 3600) + self.stale_grace.get(cache_type, 0)
+    
+    def _encode(self, payload: bytes) -> bytes:
+        """Compress large payloads for Redis"""
+        if len(payload) >= COMPRESS_MIN_BYTES:
+            return self._compressor.compress(payload)
+        return payload
+    
+    def _decode(self, stored: Optional[bytes]) -> Optional[bytes]:
+        """Undo _encode on a value read from Redis"""
+        if not stored:
+            return None
+        if stored.startswith(ZSTD_MAGIC):
+            return self._decompressor.decompress(stored)
+        return stored
+    
+    def _memory_get(self, cache_type: str, key: str) -> Optional[bytes]:
+        """Look up a key in the in-memory LRU, evicting it if expired"""
+        entry = self.memory_cache.pop(key, None)
+        if entry and time.monotonic() - entry[1] < self._storage_ttl(cache_type):
+            self.memory_cache[key] = entry  # Re-insert as most recently used
+            return entry[0]
+        return None
+    
+    async def get(self, cache_type: str, data: Any) -> Optional[bytes]:
+        """Get cached data as raw JSON bytes (callers decode)"""
         key = self._generate_key(cache_type, data)
         
         try:
             if self.redis_client:
-                cached = await self.redis_client.get(key)
-                if cached:
-                    return json.loads(cached)
+                return self._decode(await self.redis_client.get(key))
             else:
                 # Fallback to memory cache
-                if key in self.memory_cache:
-                    cached_data, timestamp = self.memory_cache[key]
-                    if datetime.now() - timestamp < timedelta(seconds=self.cache_ttl.get(cache_type, 3600)):
-                        return cached_data
-                    else:
-                        del self.memory_cache[key]
+                return self._memory_get(cache_type, key)
         except Exception as e:
             print(f"Cache get error: {e}")
         
         return None
     
     async def set(self, cache_type: str, data: Any, result: Any):
-        """Set cached data"""
+        """Set cached data, serialized once to JSON bytes"""
         key = self._generate_key(cache_type, data)
         
         try:
+            payload = orjson.dumps(result)
             if self.redis_client:
-                ttl = self.cache_ttl.get(cache_type, 3600)
-                await self.redis_client.setex(key, ttl, json.dumps(result))
+                await self.redis_client.setex(key, self._storage_ttl(cache_type), self._encode(payload))
             else:
                 # Fallback to memory cache
-                self.memory_cache[key] = (result, datetime.now())
-                # Clean old entries periodically
-                if len(self.memory_cache) > 1000:
-                    self._cleanup_memory_cache()
+                self.memory_cache[key] = (payload, time.monotonic())
+                self.memory_cache.move_to_end(key)
+                if len(self.memory_cache) > self.memory_cache_size:
+                    self.memory_cache.popitem(last=False)  # Evict least recently used
         except Exception as e:
             print(f"Cache set error: {e}")
     
-    def _cleanup_memory_cache(self):
-        """Clean up old memory cache entries"""
-        now = datetime.now()
-        keys_to_remove = []
+    async def get_or_compute(
+        self,
+        cache_type: str,
+        data: Any,
+        compute: Callable[[], Awaitable[Any]],
+        decode: Optional[Callable[[Any], Any]] = None
+    ) -> Any:
+        """
+        Get cached data, computing it at most once across concurrent callers
+        
+        Callers that miss while an identical computation is in flight await
+        its result instead of starting their own. For cache types with a
+        stale grace period, expired entries are still served while a single
+        background task refreshes them.
+        
+        Args:
+            cache_type: Cache namespace (also selects the TTL)
+            data: Data identifying the entry, as passed to get()
+            compute: Coroutine factory producing the JSON-serializable result
+            decode: Optional conversion applied to decoded cache hits so they
+                match what compute() returns
+            
+        Returns:
+            Cached or computed result (None and empty results are not cached,
+            since an upstream that answers with nothing may just be struggling)
+        """
+        key = self._generate_key(cache_type, data)
+        
+        cached = await self.get(cache_type, data)
+        if cached:
+            entry = orjson.loads(cached)
+            value = entry["value"] if cache_type in self.stale_grace else entry
+            if value:  # Empty entries cached by older versions count as misses
+                if cache_type in self.stale_grace and time.time() >= entry["expires_at"]:
+                    await self._revalidate(cache_type, data, key, compute)
+                return decode(value) if decode else value
+        
+        task = self.inflight.get(key)
+        if task is None:
+            task = self._start_compute(cache_type, data, key, compute)
+        # Shielded so a caller that is cancelled (e.g. a disconnected stream)
+        # doesn't cancel the computation other callers are waiting on
+        return await asyncio.shield(task)
+    
+    def _start_compute(self, cache_type: str, data: Any, key: str, compute: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start compute() as the single in-flight computation for key, owned by no caller"""
+        task = asyncio.create_task(self._compute(cache_type, data, compute))
+        self.inflight[key] = task
+        task.add_done_callback(lambda done: self._finish_compute(key, done))
+        return task
+    
+    def _finish_compute(self, key: str, task: asyncio.Task):
+        """Drop a finished computation from the in-flight map"""
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved so a failure nobody awaited isn't logged
+    
+    async def _compute(self, cache_type: str, data: Any, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Run compute() and cache its result"""
+        result = await compute()
+        if result:
+            if cache_type in self.stale_grace:
+                # Remember when the entry goes stale; Redis keeps it through the grace period
+                expires_at = time.time() + self.cache_ttl.get(cache_type, 3600)
+                await self.set(cache_type, data, {"expires_at": expires_at, "value": result})
+            else:
+                await self.set(cache_type, data, result)
+        return result
+    
+    async def _revalidate(self, cache_type: str, data: Any, key: str, compute: Callable[[], Awaitable[Any]]):
+        """Start a background refresh of a stale entry, at most one across workers"""
+        if key in self.inflight or key in self.refreshing:
+            return
+        if self.redis_client:
+            try:
+                if not await self.redis_client.set(f"{key}:lock", b"1", nx=True, ex=30):
+                    return  # Another worker is refreshing
+            except Exception as e:
+                print(f"Cache lock error: {e}")
+                return
         
-        for key, (_, timestamp) in self.memory_cache.items():
-            if now - timestamp > timedelta(hours=1):
-                keys_to_remove.append(key)
+        self.refreshing.add(key)
+        task = asyncio.create_task(self._refresh(cache_type, data, key, compute))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _refresh(self, cache_type: str, data: Any, key: str, compute: Callable[[], Awaitable[Any]]):
+        """Recompute a stale entry, keeping the stale copy if that fails"""
+        try:
+            await self._start_compute(cache_type, data, key, compute)
+        except Exception as e:
+            print(f"Cache refresh error: {e}")
+        finally:
+            self.refreshing.discard(key)
+    
+    async def acquire_rate_slot(self, name: str, interval: float) -> Optional[float]:
+        """
+        Claim the next request slot for a rate-limited upstream, shared by all workers
+        
+        A slot is a key that lives for the interval, so consecutive claims are
+        always at least that far apart, regardless of clock-second boundaries.
         
-        for key in keys_to_remove:
-            del self.memory_cache[key]
+        Args:
+            name: Upstream being limited
+            interval: Minimum seconds between requests
+            
+        Returns:
+            0 if a slot was claimed, otherwise the seconds until the current one
+            expires; None if Redis is unavailable and the caller must limit locally
+        """
+        if not self.redis_client:
+            return None
+        
+        key = f"saco:rl:{name}"
+        try:
+            if await self.redis_client.set(key, b"1", nx=True, px=int(interval * 1000)):
+                return 0
+            return max(await self.redis_client.pttl(key), 0) / 1000
+        except Exception as e:
+            print(f"Rate limit error: {e}")
+            return None
     
     async def close(self):
         """Close Redis connection"""
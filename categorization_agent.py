@@ -3,29 +3,120 @@ from pydantic import BaseModel
 import requests
 import time
 from dotenv import load_dotenv
-import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-import json
+from langchain_core.messages import HumanMessage, SystemMessage
+import asyncio
+import hashlib
+import orjson
+import re
+from collections import OrderedDict, defaultdict
 from cache_service import cache_service
+from llm_client import get_llm
 
 load_dotenv()
 
+def _keyword_pattern(keywords: List[str]) -> re.Pattern:
+    """Compile keywords into a single substring-matching alternation"""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+# Amenities sent to Gemini per request; the prompt size, not Python, is the real cost
+_MAX_AMENITIES_FOR_LLM = 300
+
+# Invariant categorization instructions, sent as a byte-identical prefix on every call
+_CATEGORIZATION_SYSTEM_PROMPT = """You are an expert at categorizing business amenities and services. Your task is to categorize the amenities provided by the user into logical, user-friendly categories.
+
+Rules:
+1. Group similar amenities together (e.g., all restaurants, cafes, fast food under "Dining")
+2. Use clear, intuitive category names that users would understand
+3. Aim for 6-8 main categories maximum
+4. Consider both the amenity type and the business name when categorizing
+5. Return ONLY a JSON object with categories as keys and lists of amenity names as values
+
+Return format:
+{
+  "Dining": ["Restaurant Name 1", "Restaurant Name 2"],
+  "Healthcare": ["Hospital Name", "Pharmacy Name"],
+  "Education": ["School Name"],
+  "Banking": ["Bank Name"],
+  "Shopping": ["Store Name"],
+  "Recreation": ["Park Name"],
+  "Transportation": ["Highway Name"],
+  "Other": ["Any other amenities"]
+}
+
+Important: Return ONLY the JSON object, no additional text or explanation."""
+
+# Outermost {...} in a Gemini response, whatever fences or prose surround it
+_JSON_RE = re.compile(r"\{.*\}", re.S)
+
+# Per-call part of the prompt; the only piece that varies between requests
+_AMENITIES_PROMPT_TEMPLATE = "Amenities to categorize:\n{amenities_text}"
+
+def _fingerprint(amenities: List[Dict[str, Any]]) -> str:
+    """Order-independent content hash of the (name, amenity_type) pairs"""
+    digest = hashlib.sha256()
+    for name, amenity_type in sorted(
+        (amenity.get('name', ''), amenity.get('amenity_type', '')) for amenity in amenities
+    ):
+        digest.update(f"{name}\x1f{amenity_type}\x1e".encode())
+    return digest.hexdigest()
+
+# Fallback categorization rules in priority order: (category, type keywords, name keywords)
+_CATEGORY_PATTERNS = [
+    ('Dining',
+     _keyword_pattern(['restaurant', 'cafe', 'fast_food', 'food_court']),
+     _keyword_pattern(['restaurant', 'cafe', 'pizza', 'burger', 'sushi', 'thai', 'chinese', 'mexican', 'italian'])),
+    ('Education',
+     _keyword_pattern(['school', 'university', 'college']),
+     _keyword_pattern(['school', 'university', 'college', 'academy'])),
+    ('Healthcare',
+     _keyword_pattern(['hospital', 'pharmacy', 'clinic', 'dentist']),
+     _keyword_pattern(['hospital', 'pharmacy', 'clinic', 'medical', 'health'])),
+    ('Banking',
+     _keyword_pattern(['bank', 'atm', 'bureau_de_change']),
+     _keyword_pattern(['bank', 'credit union', 'atm'])),
+    ('Shopping',
+     _keyword_pattern(['supermarket', 'convenience', 'mall', 'shop']),
+     _keyword_pattern(['market', 'store', 'shop', 'mall', 'grocery'])),
+    ('Automotive',
+     _keyword_pattern(['fuel', 'car_wash', 'garage']),
+     _keyword_pattern(['gas', 'fuel', 'shell', 'chevron', 'arco'])),
+    ('Recreation',
+     _keyword_pattern(['park', 'playground', 'sports_centre', 'pitch']),
+     _keyword_pattern(['park', 'playground', 'sports', 'recreation'])),
+    ('Transportation',
+     _keyword_pattern(['highway', 'motorway', 'primary']),
+     None),
+]
+
+def _classify(amenity_type: str, name: str) -> str:
+    """Category for a lowercased amenity type and name, first matching rule wins"""
+    for category, type_pattern, name_pattern in _CATEGORY_PATTERNS:
+        if type_pattern.search(amenity_type) or (name_pattern and name_pattern.search(name)):
+            return category
+    return 'Other'
+
 class CategorizationAgent:
     """AI Agent responsible for intelligently categorizing amenities using Gemini LLM"""
     
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=self._get_api_key(),
-            temperature=0.3  # Lower temperature for more consistent categorization
-        )
+        self.llm = get_llm(temperature=0)  # Deterministic, so identical inputs give cacheable output
+        # In-process LRU in front of cache_service, keyed by amenity fingerprint
+        self._l1_cache = OrderedDict()
+        self._l1_cache_size = 512
+    
+    def _l1_get(self, fingerprint: str) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """Look up a categorization in the in-process LRU"""
+        categorized = self._l1_cache.get(fingerprint)
+        if categorized is not None:
+            self._l1_cache.move_to_end(fingerprint)
+        return categorized
     
-    def _get_api_key(self) -> str:
-        """Get Google API key from environment"""
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable is required")
-        return api_key
+    def _l1_set(self, fingerprint: str, categorized: Dict[str, List[Dict[str, Any]]]):
+        """Store a categorization in the in-process LRU"""
+        self._l1_cache[fingerprint] = categorized
+        self._l1_cache.move_to_end(fingerprint)
+        if len(self._l1_cache) > self._l1_cache_size:
+            self._l1_cache.popitem(last=False)
     
     async def categorize_amenities(self, amenities: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
         """
@@ -38,54 +129,43 @@ class CategorizationAgent:
             Dictionary with categories as keys and lists of amenities as values
         """
         try:
-            # Check cache first
-            cached_result = await cache_service.get('categorization', {'amenities': amenities})
+            # Check the in-process cache, then the shared cache, keyed by content
+            fingerprint = _fingerprint(amenities)
+            categorized_amenities = self._l1_get(fingerprint)
+            if categorized_amenities is not None:
+                return categorized_amenities
+            
+            cache_key = {'fp': fingerprint}
+            cached_result = await cache_service.get('categorization', cache_key)
             if cached_result:
                 print(f"Using cached categorization for {len(amenities)} amenities")
-                return cached_result
+                categorized_amenities = orjson.loads(cached_result)
+                self._l1_set(fingerprint, categorized_amenities)
+                return categorized_amenities
             
-            # If too many amenities, use batch processing
+            # If too many amenities, use batch processing (deterministic, so keep it in L1)
             if len(amenities) > 1000:
                 print(f"Large dataset ({len(amenities)} amenities), using batch processing...")
-                return await self._categorize_in_batches(amenities)
+                categorized_amenities = await self._categorize_in_batches(amenities)
+                self._l1_set(fingerprint, categorized_amenities)
+                return categorized_amenities
             
             # Prepare the amenities data for the LLM
-            amenities_text = self._format_amenities_for_llm(amenities)
+            # Only the first _MAX_AMENITIES_FOR_LLM go to Gemini to bound prompt size;
+            # the rest are categorized by rules and merged in below
+            amenities_text = self._format_amenities_for_llm(amenities[:_MAX_AMENITIES_FOR_LLM])
             
-            # Create the prompt for categorization
-            prompt = f"""
-You are an expert at categorizing business amenities and services. Your task is to categorize the following amenities into logical, user-friendly categories.
-
-Rules:
-1. Group similar amenities together (e.g., all restaurants, cafes, fast food under "Dining")
-2. Use clear, intuitive category names that users would understand
-3. Aim for 6-8 main categories maximum
-4. Consider both the amenity type and the business name when categorizing
-5. Return ONLY a JSON object with categories as keys and lists of amenity names as values
-
-Amenities to categorize:
-{amenities_text}
-
-Return format:
-{{
-  "Dining": ["Restaurant Name 1", "Restaurant Name 2"],
-  "Healthcare": ["Hospital Name", "Pharmacy Name"],
-  "Education": ["School Name"],
-  "Banking": ["Bank Name"],
-  "Shopping": ["Store Name"],
-  "Recreation": ["Park Name"],
-  "Transportation": ["Highway Name"],
-  "Other": ["Any other amenities"]
-}}
-
-Important: Return ONLY the JSON object, no additional text or explanation.
-"""
+            # Static instructions first so the prompt prefix is identical across calls
+            messages = [
+                SystemMessage(content=_CATEGORIZATION_SYSTEM_PROMPT),
+                HumanMessage(content=_AMENITIES_PROMPT_TEMPLATE.format(amenities_text=amenities_text))
+            ]
             
             print(f"AI Categorizing {len(amenities)} amenities...")
             
             # Get AI categorization with timeout handling
             try:
-                response = self.llm.invoke(prompt)
+                response = await self.llm.ainvoke(messages)
                 categorization_text = response.content.strip()
             except Exception as e:
                 print(f"Gemini API error: {e}")
@@ -94,32 +174,31 @@ Important: Return ONLY the JSON object, no additional text or explanation.
             
             # Parse the JSON response
             try:
-                # Clean the response to extract just the JSON
-                if categorization_text.startswith("```json"):
-                    categorization_text = categorization_text.replace("```json", "").replace("```", "").strip()
-                elif categorization_text.startswith("```"):
-                    categorization_text = categorization_text.replace("```", "").strip()
+                # Extract just the JSON object, ignoring code fences or surrounding prose
+                match = _JSON_RE.search(categorization_text)
+                categorization = orjson.loads(match.group(0) if match else categorization_text)
                 
-                categorization = json.loads(categorization_text)
-                
-                # Convert back to amenity objects
-                categorized_amenities = {}
-                for category, amenity_names in categorization.items():
-                    categorized_amenities[category] = []
-                    for name in amenity_names:
-                        # Find the original amenity object
-                        for amenity in amenities:
-                            if amenity.get('name') == name:
-                                categorized_amenities[category].append(amenity)
-                                break
+                # Convert back to amenity objects (first amenity wins on duplicate names)
+                by_name = {}
+                for amenity in amenities:
+                    by_name.setdefault(amenity.get('name'), amenity)
+                categorized_amenities = {
+                    category: [by_name[name] for name in amenity_names if name in by_name]
+                    for category, amenity_names in categorization.items()
+                }
+                overflow = amenities[_MAX_AMENITIES_FOR_LLM:]
+                if overflow:
+                    for category, items in self._fallback_categorization(overflow).items():
+                        categorized_amenities.setdefault(category, []).extend(items)
                 
                 # Cache the result
-                await cache_service.set('categorization', {'amenities': amenities}, categorized_amenities)
+                self._l1_set(fingerprint, categorized_amenities)
+                await cache_service.set('categorization', cache_key, categorized_amenities)
                 
                 print(f"AI categorized amenities into {len(categorized_amenities)} categories")
                 return categorized_amenities
                 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 print(f"Error parsing AI response as JSON: {e}")
                 print(f"Raw response: {categorization_text}")
                 # Fallback to hard-coded categorization
@@ -131,83 +210,57 @@ Important: Return ONLY the JSON object, no additional text or explanation.
             return self._fallback_categorization(amenities)
     
     def _format_amenities_for_llm(self, amenities: List[Dict[str, Any]]) -> str:
-        """Format amenities data for LLM processing"""
-        formatted = []
-        for amenity in amenities:
-            name = amenity.get('name', 'Unknown')
-            amenity_type = amenity.get('amenity_type', 'Unknown')
-            formatted.append(f"- {name} (Type: {amenity_type})")
-        return "\n".join(formatted)
+        """Format amenities data for LLM processing, one line per distinct name and type"""
+        unique = dict.fromkeys(
+            (amenity.get('name', 'Unknown'), amenity.get('amenity_type', 'Unknown')) for amenity in amenities
+        )
+        return "\n".join(f"- {name} (Type: {amenity_type})" for name, amenity_type in unique)
     
     def _fallback_categorization(self, amenities: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
         """Fallback categorization using hard-coded rules"""
-        categories = {}
+        categories = defaultdict(list)
         
         for amenity in amenities:
-            amenity_type = amenity.get('amenity_type', '').split(':')[1] if ':' in amenity.get('amenity_type', '') else amenity.get('amenity_type', '')
-            name = amenity.get('name', '').lower()
-            
-            # Determine category based on type and name
-            if any(keyword in amenity_type.lower() for keyword in ['restaurant', 'cafe', 'fast_food', 'food_court']) or \
-               any(keyword in name for keyword in ['restaurant', 'cafe', 'pizza', 'burger', 'sushi', 'thai', 'chinese', 'mexican', 'italian']):
-                category = 'Dining'
-            elif any(keyword in amenity_type.lower() for keyword in ['school', 'university', 'college']) or \
-                 any(keyword in name for keyword in ['school', 'university', 'college', 'academy']):
-                category = 'Education'
-            elif any(keyword in amenity_type.lower() for keyword in ['hospital', 'pharmacy', 'clinic', 'dentist']) or \
-                 any(keyword in name for keyword in ['hospital', 'pharmacy', 'clinic', 'medical', 'health']):
-                category = 'Healthcare'
-            elif any(keyword in amenity_type.lower() for keyword in ['bank', 'atm', 'bureau_de_change']) or \
-                 any(keyword in name for keyword in ['bank', 'credit union', 'atm']):
-                category = 'Banking'
-            elif any(keyword in amenity_type.lower() for keyword in ['supermarket', 'convenience', 'mall', 'shop']) or \
-                 any(keyword in name for keyword in ['market', 'store', 'shop', 'mall', 'grocery']):
-                category = 'Shopping'
-            elif any(keyword in amenity_type.lower() for keyword in ['fuel', 'car_wash', 'garage']) or \
-                 any(keyword in name for keyword in ['gas', 'fuel', 'shell', 'chevron', 'arco']):
-                category = 'Automotive'
-            elif any(keyword in amenity_type.lower() for keyword in ['park', 'playground', 'sports_centre', 'pitch']) or \
-                 any(keyword in name for keyword in ['park', 'playground', 'sports', 'recreation']):
-                category = 'Recreation'
-            elif any(keyword in amenity_type.lower() for keyword in ['highway', 'motorway', 'primary']):
-                category = 'Transportation'
-            else:
-                category = 'Other'
+            # Second segment of "key:value[:...]" types, parsed once per amenity
+            raw_type = amenity.get('amenity_type') or ''
+            key, separator, rest = raw_type.partition(':')
+            amenity_type = (rest.partition(':')[0] if separator else key).lower()
+            name = (amenity.get('name') or '').lower()
             
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(amenity)
+            # Determine category based on type and name, first match wins
+            categories[_classify(amenity_type, name)].append(amenity)
         
-        return categories
+        return dict(categories)
     
     async def _categorize_in_batches(self, amenities: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
         """Categorize amenities in smaller batches to avoid API timeouts"""
         batch_size = 500  # Process 500 amenities at a time
-        all_categorized = {}
+        total_batches = (len(amenities) + batch_size - 1) // batch_size
+        semaphore = asyncio.Semaphore(4)  # Max batches in flight
         
         print(f"Processing {len(amenities)} amenities in batches of {batch_size}")
         
-        for i in range(0, len(amenities), batch_size):
-            batch = amenities[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            total_batches = (len(amenities) + batch_size - 1) // batch_size
-            
-            print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} amenities)")
-            
-            try:
-                # Use hard-coded categorization for large batches to avoid API timeouts
-                batch_categorized = self._fallback_categorization(batch)
-                
-                # Merge results
-                for category, items in batch_categorized.items():
-                    if category not in all_categorized:
-                        all_categorized[category] = []
-                    all_categorized[category].extend(items)
-                    
-            except Exception as e:
-                print(f"Error processing batch {batch_num}: {e}")
+        async def run_batch(batch_num: int, batch: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+            async with semaphore:
+                print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} amenities)")
+                # Use hard-coded categorization for large batches to avoid API timeouts,
+                # off the event loop so other requests keep being served
+                return await asyncio.to_thread(self._fallback_categorization, batch)
+        
+        results = await asyncio.gather(
+            *(run_batch((i // batch_size) + 1, amenities[i:i + batch_size]) for i in range(0, len(amenities), batch_size)),
+            return_exceptions=True
+        )
+        
+        # Merge results in batch order
+        all_categorized = defaultdict(list)
+        for batch_num, batch_categorized in enumerate(results, start=1):
+            if isinstance(batch_categorized, Exception):
+                print(f"Error processing batch {batch_num}: {batch_categorized}")
                 # Continue with next batch
                 continue
+            for category, items in batch_categorized.items():
+                all_categorized[category].extend(items)
         
         print(f"Batch processing complete. Categorized into {len(all_categorized)} categories")
-        return all_categorized
+        return dict(all_categorized)
@@ -4,6 +4,6 @@ echo Press Ctrl+C to stop
 echo.
 
 :loop
-python simple_keep_alive.py
+python keep_alive.py --quiet
 timeout /t 5 /nobreak >nul
 goto loop
@@ -2,43 +2,69 @@
 """
 Keep-alive script for Render backend
 Pings the backend every 10 minutes to prevent it from sleeping
+
+Usage: python keep_alive.py [--interval SECONDS] [--quiet]
 """
 
-import requests
-import time
+import aiohttp
+import argparse
+import asyncio
 import sys
 from datetime import datetime
 
 # Your Render backend URL
 BACKEND_URL = "https://saco-ai-assistant.onrender.com"
 
-def ping_backend():
-    """Ping the backend to keep it alive"""
+# Endpoints to keep alive, all pinged concurrently over one session
+PING_URLS = [
+    f"{BACKEND_URL}/ping",
+]
+
+def log(message: str, quiet: bool):
+    """Print a timestamped status line (short timestamp in quiet mode)"""
+    timestamp = datetime.now().strftime('%H:%M:%S' if quiet else '%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+async def ping_url(session: aiohttp.ClientSession, url: str, quiet: bool = False) -> bool:
+    """Ping a single endpoint to keep it alive"""
     try:
-        response = requests.get(f"{BACKEND_URL}/ping", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Ping successful: {data.get('message', 'OK')}")
-            return True
-        else:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Ping failed: HTTP {response.status_code}")
-            return False
-    except requests.exceptions.RequestException as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Ping failed: {e}")
+        async with session.get(url) as response:
+            if response.status == 200:
+                if quiet:
+                    log("✅ Ping OK", quiet)
+                else:
+                    data = await response.json()
+                    log(f"✅ Ping successful ({url}): {data.get('message', 'OK')}", quiet)
+                return True
+            else:
+                log(f"❌ Ping failed ({url}): HTTP {response.status}", quiet)
+                return False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log(f"❌ Ping failed ({url}): {e}", quiet)
         return False
 
+async def keep_alive(ping_interval: int, quiet: bool = False):
+    """Ping every endpoint, then sleep, reusing the same connections each round"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            await asyncio.gather(*(ping_url(session, url, quiet) for url in PING_URLS))
+            if not quiet:
+                print(f"⏰ Next ping in {ping_interval // 60} minutes...")
+            await asyncio.sleep(ping_interval)
+
 def main():
     """Main keep-alive loop"""
-    print(f"🚀 Starting keep-alive for {BACKEND_URL}")
-    print("Press Ctrl+C to stop")
-    
-    ping_interval = 10 * 60  # 10 minutes in seconds
+    parser = argparse.ArgumentParser(description="Keep the Render backend awake")
+    parser.add_argument("--interval", type=int, default=10 * 60, help="Seconds between pings (default: 600)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Print one short line per ping")
+    args = parser.parse_args()
     
+    print(f"🚀 Starting keep-alive for {', '.join(PING_URLS)}")
+    print("Press Ctrl+C to stop")
+
     try:
-        while True:
-            ping_backend()
-            print(f"⏰ Next ping in {ping_interval // 60} minutes...")
-            time.sleep(ping_interval)
+        asyncio.run(keep_alive(args.interval, args.quiet))
     except KeyboardInterrupt:
         print("\n🛑 Keep-alive stopped by user")
         sys.exit(0)
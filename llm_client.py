@@ -0,0 +1,38 @@
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+from langchain_core.runnables import Runnable
+from langchain_google_genai import ChatGoogleGenerativeAI
+from config import GEMINI_MODEL
+
+load_dotenv()
+
+def _get_api_key() -> str:
+    """Get Google API key from environment"""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is required")
+    return api_key
+
+@lru_cache(maxsize=1)
+def _shared_llm() -> ChatGoogleGenerativeAI:
+    """The process-wide Gemini client, built on first use"""
+    return ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL,
+        google_api_key=_get_api_key()
+    )
+
+def get_llm(temperature: float) -> Runnable:
+    """
+    Get the shared Gemini client configured for a temperature
+
+    Every agent gets a binding over the same ChatGoogleGenerativeAI, so they
+    share one client and its connections; the temperature is sent per request.
+
+    Args:
+        temperature: Sampling temperature
+
+    Returns:
+        The shared client bound to the temperature
+    """
+    return _shared_llm().bind(generation_config={"temperature": temperature})
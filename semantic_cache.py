@@ -0,0 +1,90 @@
+import math
+import orjson
+from typing import Dict, List, Optional
+from cache_service import cache_service
+
+class SemanticCache:
+    """Reuses Gemini location analyses for the same address with a similar amenity profile"""
+
+    def __init__(self):
+        self.distance_threshold = 0.1  # Max cosine distance between category profiles
+        self.max_entries_per_cell = 8
+
+    def _cell(self, latitude: float, longitude: float) -> str:
+        """Neighborhood key: coordinates rounded to ~1km"""
+        return f"{round(latitude, 2)},{round(longitude, 2)}"
+
+    def _normalize_address(self, address: str) -> str:
+        """Case- and whitespace-insensitive form of an address"""
+        return " ".join(address.lower().split())
+
+    def _cosine_distance(self, a: Dict[str, int], b: Dict[str, int]) -> float:
+        """Cosine distance between two category-count vectors"""
+        dot = sum(count * b.get(category, 0) for category, count in a.items())
+        norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+        if not norm:
+            return 1.0
+        return 1.0 - dot / norm
+
+    async def _entries(self, cell: str) -> List[Dict]:
+        """Load the cached analyses for a neighborhood"""
+        cached = await cache_service.get('analysis', {'cell': cell})
+        return orjson.loads(cached) if cached else []
+
+    async def load(self, latitude: float, longitude: float) -> List[Dict]:
+        """Load the cached analyses around a location, e.g. to prefetch them for check()"""
+        return await self._entries(self._cell(latitude, longitude))
+
+    async def check(
+        self,
+        latitude: float,
+        longitude: float,
+        address: str,
+        category_counts: Dict[str, int],
+        entries: Optional[List[Dict]] = None
+    ) -> Optional[str]:
+        """
+        Find a cached analysis for the same address with a similar amenity profile
+
+        Analyses quote the address and the amenity totals they were generated
+        for, so only entries for the same address with the same total
+        are reused; the cosine distance then tolerates small shifts in mix.
+
+        Args:
+            latitude: Location latitude
+            longitude: Location longitude
+            address: Address the analysis is for
+            category_counts: Number of amenities per category
+            entries: Entries already fetched with load(), to skip the cache lookup
+
+        Returns:
+            The closest cached analysis within the distance threshold, or None
+        """
+        if entries is None:
+            entries = await self.load(latitude, longitude)
+        address = self._normalize_address(address)
+        total = sum(category_counts.values())
+        best, best_distance = None, self.distance_threshold
+        for entry in entries:
+            if entry.get("address") != address or sum(entry["counts"].values()) != total:
+                continue
+            distance = self._cosine_distance(category_counts, entry["counts"])
+            if distance <= best_distance:
+                best, best_distance = entry["result"], distance
+        return best
+
+    async def store(self, latitude: float, longitude: float, address: str, category_counts: Dict[str, int], result: str):
+        """
+        Add an analysis to its neighborhood, keeping the most recent entries
+
+        This is a read-modify-write of the cell's list, so concurrent stores to
+        the same cell can drop each other's entry. That only costs a later
+        cache miss, which is acceptable for a best-effort cache.
+        """
+        cell = self._cell(latitude, longitude)
+        entries = await self._entries(cell)
+        entries.append({"address": self._normalize_address(address), "counts": category_counts, "result": result})
+        await cache_service.set('analysis', {'cell': cell}, entries[-self.max_entries_per_cell:])
+
+# Global semantic cache instance
+semantic_cache = SemanticCache()
@@ -11,6 +11,9 @@ def main():
     """Start the FastAPI server"""
     load_dotenv()
     
+    # "dev" runs a single auto-reloading process; anything else runs production workers
+    env = os.getenv("ENV", "dev")
+    
     # Check if API key is configured
     if not os.getenv("GOOGLE_API_KEY"):
         print("Warning: GOOGLE_API_KEY not found in environment variables")
@@ -25,13 +28,27 @@ def main():
     print("\nPress Ctrl+C to stop the server")
     
     # Start the server
-    uvicorn.run(
-        "api:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,  # Enable auto-reload for development
-        log_level="info"
-    )
+    if env == "dev":
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,  # Enable auto-reload for development
+            log_level="info"
+        )
+    else:
+        # Production: one worker process per core, on uvloop where it is installed
+        # (it has no Windows build) and with the httptools parser
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+            loop="auto",
+            http="httptools",
+            reload=False,
+            log_level="info"
+        )
 
 if __name__ == "__main__":
     main()
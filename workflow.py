@@ -1,22 +1,28 @@
-from typing import Dict, Any, List, Optional, TypedDict
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from dataclasses import dataclass, field
 from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from agents import GeocodingAgent, AmenitiesAgent, Coordinates, Amenity
 from categorization_agent import CategorizationAgent
 from cache_service import cache_service
+from semantic_cache import semantic_cache
+from llm_client import get_llm
+from config import GEMINI_TEMPERATURE
 import json
 import asyncio
 
-class AgentState(TypedDict):
+@dataclass(slots=True)
+class AgentState:
     """State for the multi-agent workflow"""
     address: str
-    radius: Optional[int]
-    coordinates: Optional[Coordinates]
-    amenities: List[Amenity]
-    categorized_amenities: Optional[Dict[str, List[Dict[str, Any]]]]
-    result: Optional[str]
-    error: Optional[str]
+    radius: Optional[int] = None
+    coordinates: Optional[Coordinates] = None
+    amenities: List[Amenity] = field(default_factory=list)
+    categorized_amenities: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    analysis_candidates: Optional[List[Dict[str, Any]]] = None
+    total_amenities: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None
 
 class MultiAgentWorkflow:
     """LangGraph workflow coordinating geocoding and amenities agents"""
@@ -25,11 +31,7 @@ class MultiAgentWorkflow:
         self.geocoding_agent = GeocodingAgent()
         self.amenities_agent = AmenitiesAgent()
         self.categorization_agent = CategorizationAgent()
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=self._get_api_key(),
-            temperature=0.7
-        )
+        self.llm = get_llm(temperature=GEMINI_TEMPERATURE)
         self.graph = self._build_graph()
         self._initialized = False
     
@@ -40,14 +42,6 @@ class MultiAgentWorkflow:
             self._initialized = True
             print("Workflow initialized with caching")
     
-    def _get_api_key(self) -> str:
-        """Get Google API key from environment"""
-        import os
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable is required")
-        return api_key
-    
     def _build_graph(self) -> StateGraph:
         """Build the LangGraph workflow"""
         workflow = StateGraph(AgentState)
@@ -70,16 +64,16 @@ class MultiAgentWorkflow:
         print(f"\nStep 1: Geocoding address...")
         
         try:
-            coordinates = await self.geocoding_agent.geocode_address(state["address"])
+            coordinates = await self.geocoding_agent.geocode_address(state.address)
             
             if coordinates:
-                state["coordinates"] = coordinates
-                state["error"] = None
+                state.coordinates = coordinates
+                state.error = None
             else:
-                state["error"] = f"Could not find coordinates for address: {state['address']}"
+                state.error = f"Could not find coordinates for address: {state.address}"
                 
         except Exception as e:
-            state["error"] = f"Error during geocoding: {str(e)}"
+            state.error = f"Error during geocoding: {str(e)}"
         
         return state
     
@@ -87,15 +81,20 @@ class MultiAgentWorkflow:
         """Node for finding amenities and categorizing them in parallel"""
         print(f"\nStep 2: Finding amenities and categorizing in parallel...")
         
-        if state.get("error"):
+        if state.error:
             return state
         
         try:
-            coordinates = state["coordinates"]
-            radius = state.get("radius", None)
+            coordinates = state.coordinates
+            radius = state.radius
             
-            # Run amenities and categorization in parallel
-            amenities = await self.amenities_agent.find_nearby_amenities(coordinates, radius)
+            # Fetch amenities while prefetching cached analyses for this neighborhood,
+            # which only need the coordinates
+            amenities, analysis_candidates = await asyncio.gather(
+                self.amenities_agent.find_nearby_amenities(coordinates, radius),
+                semantic_cache.load(coordinates.latitude, coordinates.longitude)
+            )
+            state.analysis_candidates = analysis_candidates
             
             if amenities:
                 # Convert amenities to dict format for categorization
@@ -109,82 +108,147 @@ class MultiAgentWorkflow:
                 # Run categorization
                 categorized = await self.categorization_agent.categorize_amenities(amenities_data)
                 
-                state["amenities"] = amenities
-                state["categorized_amenities"] = categorized
+                state.amenities = amenities
+                state.categorized_amenities = categorized
+                # Categorization can drop names Gemini didn't echo back exactly; fall back to the raw count
+                state.total_amenities = sum(len(items) for items in categorized.values()) or len(amenities)
                 print(f"Found {len(amenities)} amenities and categorized into {len(categorized)} categories")
             else:
-                state["amenities"] = []
-                state["categorized_amenities"] = {}
+                state.amenities = []
+                state.categorized_amenities = {}
                 
         except Exception as e:
             print(f"Error in parallel processing: {e}")
-            state["error"] = f"Error finding amenities: {str(e)}"
+            state.error = f"Error finding amenities: {str(e)}"
         
         return state
     
+    def _build_analysis_messages(self, state: AgentState) -> Tuple[List[BaseMessage], Optional[Dict[str, int]]]:
+        """Build the Gemini messages for the analysis, plus per-category counts when categorized"""
+        coordinates = state.coordinates
+        categorized_amenities = state.categorized_amenities
+        
+        # If we have categorized amenities, use them (much more efficient)
+        category_counts = None
+        if categorized_amenities:
+            category_counts = {category: len(items) for category, items in categorized_amenities.items()}
+            print(f"Using categorized data for analysis ({len(categorized_amenities)} categories)")
+            prompt = self._create_prompt_from_categories(state.address, coordinates, categorized_amenities, state.total_amenities)
+        else:
+            # Fallback to raw amenities (limit to avoid timeout)
+            amenities = state.amenities
+            print(f"Using raw amenities for analysis (limited to 100 items)")
+            
+            # Limit amenities to avoid timeout
+            limited_amenities = amenities[:100] if len(amenities) > 100 else amenities
+            
+            # Group amenities by type
+            amenities_by_type = {}
+            for amenity in limited_amenities:
+                amenity_type = amenity.amenity_type.split(":")[0]  # Get main category
+                if amenity_type not in amenities_by_type:
+                    amenities_by_type[amenity_type] = []
+                amenities_by_type[amenity_type].append(amenity.name)
+            
+            prompt = self._create_prompt(state.address, coordinates, amenities_by_type)
+        
+        messages = [
+            SystemMessage(content="You are a helpful assistant that provides detailed information about locations and their nearby amenities."),
+            HumanMessage(content=prompt)
+        ]
+        return messages, category_counts
+    
     async def _process_results_node(self, state: AgentState) -> AgentState:
         """Node for processing results with Gemini LLM"""
         print(f"\nStep 3: Processing results with Gemini...")
         
-        if state.get("error"):
-            state["result"] = f"Error: {state['error']}"
+        if state.error:
+            state.result = f"Error: {state.error}"
+            return state
+        
+        # Nothing to analyze, so don't spend a Gemini call on it
+        if not state.amenities:
+            state.result = self._create_empty_analysis(state.address, state.coordinates)
             return state
         
         try:
             # Prepare data for LLM
-            coordinates = state["coordinates"]
-            categorized_amenities = state.get("categorized_amenities", {})
-            
-            # If we have categorized amenities, use them (much more efficient)
-            if categorized_amenities:
-                print(f"Using categorized data for analysis ({len(categorized_amenities)} categories)")
-                prompt = self._create_prompt_from_categories(state["address"], coordinates, categorized_amenities)
-            else:
-                # Fallback to raw amenities (limit to avoid timeout)
-                amenities = state["amenities"]
-                print(f"Using raw amenities for analysis (limited to 100 items)")
-                
-                # Limit amenities to avoid timeout
-                limited_amenities = amenities[:100] if len(amenities) > 100 else amenities
-                
-                # Group amenities by type
-                amenities_by_type = {}
-                for amenity in limited_amenities:
-                    amenity_type = amenity.amenity_type.split(":")[0]  # Get main category
-                    if amenity_type not in amenities_by_type:
-                        amenities_by_type[amenity_type] = []
-                    amenities_by_type[amenity_type].append(amenity.name)
-                
-                prompt = self._create_prompt(state["address"], coordinates, amenities_by_type)
+            coordinates = state.coordinates
+            messages, category_counts = self._build_analysis_messages(state)
             
             # Get response from Gemini with timeout handling
             try:
-                messages = [
-                    SystemMessage(content="You are a helpful assistant that provides detailed information about locations and their nearby amenities."),
-                    HumanMessage(content=prompt)
-                ]
+                # Reuse an analysis of a similar nearby location if one is cached
+                cached_analysis = None
+                if category_counts:
+                    cached_analysis = await semantic_cache.check(
+                        coordinates.latitude, coordinates.longitude, state.address, category_counts, state.analysis_candidates
+                    )
                 
-                response = self.llm.invoke(messages)
-                state["result"] = response.content
-                state["error"] = None
+                if cached_analysis:
+                    print("Using semantically cached analysis")
+                    state.result = cached_analysis
+                else:
+                    response = await self.llm.ainvoke(messages)
+                    state.result = response.content
+                    if category_counts:
+                        await semantic_cache.store(coordinates.latitude, coordinates.longitude, state.address, category_counts, response.content)
+                state.error = None
                 
             except Exception as e:
                 print(f"Gemini API timeout/error: {e}")
                 # Fallback to simple analysis
-                state["result"] = self._create_fallback_analysis(state["address"], coordinates, categorized_amenities)
-                state["error"] = None
+                state.result = self._create_fallback_analysis(state.address, coordinates, state.categorized_amenities, state.total_amenities)
+                state.error = None
             
         except Exception as e:
-            state["error"] = f"Error processing results: {str(e)}"
-            state["result"] = f"Error: {str(e)}"
+            state.error = f"Error processing results: {str(e)}"
+            state.result = f"Error: {str(e)}"
         
         return state
     
-    def _create_prompt_from_categories(self, address: str, coordinates: Coordinates, categorized_amenities: Dict[str, List[Dict]]) -> str:
-        """Create a prompt using categorized amenities (much more efficient)"""
+    async def _stream_results(self, state: AgentState) -> AsyncIterator[str]:
+        """Stream the Gemini analysis as it is generated"""
+        print(f"\nStep 3: Streaming results from Gemini...")
+        
+        coordinates = state.coordinates
+        
+        # Nothing to analyze, so don't spend a Gemini call on it
+        if not state.amenities:
+            yield self._create_empty_analysis(state.address, coordinates)
+            return
+        
+        messages, category_counts = self._build_analysis_messages(state)
+        
+        # Reuse an analysis of a similar nearby location if one is cached
+        if category_counts:
+            cached_analysis = await semantic_cache.check(
+                coordinates.latitude, coordinates.longitude, state.address, category_counts, state.analysis_candidates
+            )
+            if cached_analysis:
+                print("Using semantically cached analysis")
+                yield cached_analysis
+                return
         
-        # Count total amenities
-        total_amenities = sum(len(items) for items in categorized_amenities.values())
+        chunks = []
+        try:
+            async for chunk in self.llm.astream(messages):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            print(f"Gemini API timeout/error: {e}")
+            if chunks:
+                raise  # Part of the answer was already sent
+            # Fallback to simple analysis
+            yield self._create_fallback_analysis(state.address, coordinates, state.categorized_amenities, state.total_amenities)
+            return
+        
+        if category_counts:
+            await semantic_cache.store(coordinates.latitude, coordinates.longitude, state.address, category_counts, "".join(chunks))
+    
+    def _create_prompt_from_categories(self, address: str, coordinates: Coordinates, categorized_amenities: Dict[str, List[Dict]], total_amenities: int) -> str:
+        """Create a prompt using categorized amenities (much more efficient)"""
         
         # Create summary of categories
         categories_summary = []
@@ -216,15 +280,12 @@ Please provide a detailed, well-structured analysis that would be helpful for so
 """
         return prompt
     
-    def _create_fallback_analysis(self, address: str, coordinates: Coordinates, categorized_amenities: Dict[str, List[Dict]]) -> str:
+    def _create_fallback_analysis(self, address: str, coordinates: Coordinates, categorized_amenities: Dict[str, List[Dict]], total_amenities: int) -> str:
         """Create a fallback analysis when Gemini API fails"""
         
         if not categorized_amenities:
             return f"## Location Analysis\n\n**Address:** {address}\n**Coordinates:** {coordinates.latitude}, {coordinates.longitude}\n\n*Analysis unavailable due to API limitations.*"
         
-        # Count amenities
-        total_amenities = sum(len(items) for items in categorized_amenities.values())
-        
         # Create basic analysis
         analysis = f"""## Location Analysis
 
@@ -252,6 +313,10 @@ Total amenities found: {total_amenities}
         
         return analysis
     
+    def _create_empty_analysis(self, address: str, coordinates: Coordinates) -> str:
+        """Create the analysis for a location with no amenities nearby"""
+        return f"## Location Analysis\n\n**Address:** {address}\n**Coordinates:** {coordinates.latitude}, {coordinates.longitude}\n\n*No nearby amenities were found within the search radius.*"
+    
     def _create_prompt(self, address: str, coordinates: Coordinates, amenities_by_type: Dict[str, List[str]]) -> str:
         """Create a comprehensive prompt for Gemini"""
         
@@ -292,23 +357,14 @@ Total amenities found: {total_amenities}
         # Initialize cache if not already done
         await self.initialize()
         
-        initial_state = AgentState(
-            address=address,
-            radius=radius,
-            coordinates=None,
-            amenities=[],
-            categorized_amenities=None,
-            result=None,
-            error=None
-        )
+        state = AgentState(address=address, radius=radius)
         
         try:
             # Run the workflow steps sequentially with async operations
-            state = initial_state.copy()
             
             # Step 1: Geocode
             state = await self._geocode_node(state)
-            if state.get("error"):
+            if state.error:
                 return {
                     "success": False,
                     "address": address,
@@ -316,33 +372,33 @@ Total amenities found: {total_amenities}
                     "amenities": [],
                     "categorized_amenities": None,
                     "result": None,
-                    "error": state["error"]
+                    "error": state.error
                 }
             
             # Step 2: Find amenities and categorize
             state = await self._find_amenities_and_categorize_node(state)
-            if state.get("error"):
+            if state.error:
                 return {
                     "success": False,
                     "address": address,
-                    "coordinates": state.get("coordinates"),
-                    "amenities": state.get("amenities", []),
-                    "categorized_amenities": state.get("categorized_amenities"),
+                    "coordinates": state.coordinates,
+                    "amenities": state.amenities,
+                    "categorized_amenities": state.categorized_amenities,
                     "result": None,
-                    "error": state["error"]
+                    "error": state.error
                 }
             
             # Step 3: Process results
             state = await self._process_results_node(state)
             
             return {
-                "success": state.get("error") is None,
-                "address": state["address"],
-                "coordinates": state.get("coordinates"),
-                "amenities": state.get("amenities", []),
-                "categorized_amenities": state.get("categorized_amenities"),
-                "result": state.get("result"),
-                "error": state.get("error")
+                "success": state.error is None,
+                "address": state.address,
+                "coordinates": state.coordinates,
+                "amenities": state.amenities,
+                "categorized_amenities": state.categorized_amenities,
+                "result": state.result,
+                "error": state.error
             }
             
         except Exception as e:
@@ -355,3 +411,50 @@ Total amenities found: {total_amenities}
                 "result": None,
                 "error": f"Workflow error: {str(e)}"
             }
+    
+    async def process_address_stream(self, address: str, radius: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a US address, streaming the analysis as it is generated
+        
+        Yields a "context" event with coordinates and amenities once they are
+        known, then "analysis" events with text chunks, then a final "done"
+        event. Failures are reported as a single "error" event.
+        """
+        print(f"\nStarting streaming workflow for address: {address}")
+        if radius:
+            print(f"Using custom radius: {radius}m")
+        
+        # Initialize cache if not already done
+        await self.initialize()
+        
+        state = AgentState(address=address, radius=radius)
+        
+        try:
+            # Step 1: Geocode
+            state = await self._geocode_node(state)
+            if state.error:
+                yield {"type": "error", "error": state.error}
+                return
+            
+            # Step 2: Find amenities and categorize
+            state = await self._find_amenities_and_categorize_node(state)
+            if state.error:
+                yield {"type": "error", "error": state.error}
+                return
+            
+            yield {
+                "type": "context",
+                "address": state.address,
+                "coordinates": state.coordinates,
+                "amenities": state.amenities,
+                "categorized_amenities": state.categorized_amenities
+            }
+            
+            # Step 3: Stream results
+            async for text in self._stream_results(state):
+                yield {"type": "analysis", "content": text}
+            
+            yield {"type": "done"}
+            
+        except Exception as e:
+            yield {"type": "error", "error": f"Workflow error: {str(e)}"}